@@ -7,118 +7,218 @@ Now includes both normal and inverted outputs:
 - svg_inverted, png_inverted
 - image (prefers svg), image_inverted (prefers svg_inverted)
 - png_scale, svg_size_bytes, png_size_bytes, svg_inverted_size_bytes, png_inverted_size_bytes
+
+Frontmatter is looked for in the first 8 KiB (HEAD_BYTES) of each diagram, and
+whichever style matches there wins (/* ... */ before --- ... ---). The rest of
+the file is only searched when the header holds neither style.
+
+Set STRICT_IDS=1 to skip diagrams whose frontmatter has no top-level id.
 """
 
+import codecs
 import os
 import re
+import stat
+import tempfile
 import yaml
-from glob import glob
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from functools import partial
+
+try:
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _Dumper
+except ImportError:
+    from yaml import SafeLoader as _Loader, SafeDumper as _Dumper
 
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-DIAGRAMS_GLOB = os.path.join(ROOT, "diagrams", "*.mmd")
+DIAGRAMS_DIR = os.path.join(ROOT, "diagrams")
+# Index paths are POSIX-style and relative to ROOT; built once, then concatenated per entry
+DIAGRAMS_PREFIX = os.path.relpath(DIAGRAMS_DIR, ROOT).replace(os.sep, '/') + '/'
 OUT_INDEX = os.path.join(ROOT, "index.yml")
+# Frontmatter must start within this many bytes to take precedence; see module docstring
+HEAD_BYTES = 8192
+
+_FM_BLOCK = re.compile(r'/\*\s*(.*?)\s*\*/', re.S)
+_FM_YAML = re.compile(r'---\s*(.*?)\s*---', re.S)
+_STAR_STRIP = re.compile(r'^\s*\*\s?', re.M)
+
+# Frontmatter fields copied into each index entry unchanged
+_PASSTHROUGH_KEYS = ('id', 'title', 'kind', 'area', 'version', 'tags', 'owner',
+                     'ai_generator', 'prompt_file', 'prompt_hash')
 
 def extract_frontmatter(text):
     # Try both block-comment style /* ... */ and YAML-style --- ... ---
-    m = re.search(r'/\*\s*(.*?)\s*\*/', text, re.S)
+    # A plain substring check is far cheaper than running a regex that cannot match
+    m = _FM_BLOCK.search(text) if '/*' in text else None
     if m:
         fm = m.group(1)
-        fm = re.sub(r'^\s*\*\s?', '', fm, flags=re.MULTILINE)
+        fm = _STAR_STRIP.sub('', fm)
         return fm.strip()
-    m2 = re.search(r'---\s*(.*?)\s*---', text, re.S)
+    m2 = _FM_YAML.search(text) if '---' in text else None
     if m2:
         return m2.group(1).strip()
     return None
 
 def safe_load_yaml(yaml_text):
     try:
-        return yaml.safe_load(yaml_text) or {}
+        return yaml.load(yaml_text, Loader=_Loader) or {}
     except Exception as e:
         print(f"[warn] YAML parse error: {e}")
         return {}
 
-def file_size_bytes(path):
+def scan_diagrams(directory):
+    # One readdir pass yields the .mmd sources plus existence and size
+    # for every rendered artifact next to them
+    sources = []
+    sizes = {}
     try:
-        return os.path.getsize(path)
-    except Exception:
+        with os.scandir(directory) as it:
+            for entry in it:
+                # glob('*.mmd') never matched hidden files; keep skipping them
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    sizes[entry.name] = entry.stat().st_size
+                except OSError:
+                    continue
+                if entry.name.endswith('.mmd'):
+                    sources.append(entry)
+    except OSError as e:
+        print(f"[warn] Cannot scan {directory}: {e}")
+    sources.sort(key=lambda e: e.name)
+    return sources, sizes
+
+def read_frontmatter(filepath):
+    try:
+        # Raw fd reads skip the fstat/lseek/ioctl calls that open() adds
+        fd = os.open(filepath, os.O_RDONLY)
+        try:
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            # os.read may return short without being at EOF (FUSE, NFS), so
+            # only an empty read means the file ended inside the header
+            head = b''
+            at_eof = False
+            while len(head) < HEAD_BYTES:
+                chunk = os.read(fd, HEAD_BYTES - len(head))
+                if not chunk:
+                    at_eof = True
+                    break
+                head += chunk
+            text = decoder.decode(head, final=at_eof)
+            fm_text = extract_frontmatter(text)
+            if fm_text is None and not at_eof:
+                chunks = []
+                while True:
+                    chunk = os.read(fd, 65536)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                text += decoder.decode(b''.join(chunks), final=True)
+                fm_text = extract_frontmatter(text)
+        finally:
+            os.close(fd)
+    except Exception as e:
+        print(f"[error] Cannot read {filepath}: {e}")
         return None
+    if not fm_text:
+        print(f"[warn] No frontmatter found in {filepath}; skipping")
+        return None
+    return fm_text
+
+def has_id_key(fm_text):
+    # Top-level "id:" lookup without a YAML parse
+    return fm_text.startswith('id:') or '\nid:' in fm_text
+
+def build_entry(dir_entry, sizes, png_scale, strict=False):
+    filepath = dir_entry.path
+    fm_text = read_frontmatter(filepath)
+    if fm_text is None:
+        return None
+    if strict and not has_id_key(fm_text):
+        print(f"[warn] No id in frontmatter of {filepath}; skipping")
+        return None
+
+    data = safe_load_yaml(fm_text)
+    if not isinstance(data, dict):
+        print(f"[warn] Frontmatter in {filepath} didn't parse to dict; skipping")
+        return None
+
+    rel_mmd = DIAGRAMS_PREFIX + dir_entry.name
+    name = dir_entry.name[:-4]
+    svg_name = name + '.svg'
+    png_name = name + '.png'
+    svg_inv_name = name + '-inverted.svg'
+    png_inv_name = name + '-inverted.png'
+    rel_svg = DIAGRAMS_PREFIX + svg_name
+    rel_png = DIAGRAMS_PREFIX + png_name
+    rel_svg_inv = DIAGRAMS_PREFIX + svg_inv_name
+    rel_png_inv = DIAGRAMS_PREFIX + png_inv_name
+
+    svg_size = sizes.get(svg_name)
+    png_size = sizes.get(png_name)
+    svg_inv_size = sizes.get(svg_inv_name)
+    png_inv_size = sizes.get(png_inv_name)
+    svg_exists = svg_size is not None
+    png_exists = png_size is not None
+    svg_inv_exists = svg_inv_size is not None
+    png_inv_exists = png_inv_size is not None
+
+    output_img = rel_svg if svg_exists else (rel_png if png_exists else None)
+    output_img_inverted = rel_svg_inv if svg_inv_exists else (rel_png_inv if png_inv_exists else None)
+    last_generated = data.get('last_generated') or date.today().isoformat()
+
+    entry = {k: data.get(k) for k in _PASSTHROUGH_KEYS}
+    entry['last_generated'] = last_generated
+    entry['related_code'] = data.get('related_code', [])
+    entry['mmd'] = rel_mmd
+    entry['svg'] = rel_svg if svg_exists else None
+    entry['png'] = rel_png if png_exists else None
+    entry['svg_inverted'] = rel_svg_inv if svg_inv_exists else None
+    entry['png_inverted'] = rel_png_inv if png_inv_exists else None
+    entry['image'] = output_img
+    entry['image_inverted'] = output_img_inverted
+    entry['png_scale'] = png_scale
+    entry['svg_size_bytes'] = svg_size
+    entry['png_size_bytes'] = png_size
+    entry['svg_inverted_size_bytes'] = svg_inv_size
+    entry['png_inverted_size_bytes'] = png_inv_size
+    return entry
 
 def main():
     png_scale = int(os.environ.get("PNG_SCALE", "3"))
-    entries = []
-    files = sorted(glob(DIAGRAMS_GLOB))
-    for filepath in files:
-        try:
-            with open(filepath, 'r', encoding='utf-8') as fh:
-                text = fh.read()
-        except Exception as e:
-            print(f"[error] Cannot read {filepath}: {e}")
-            continue
-
-        fm_text = extract_frontmatter(text)
-        if not fm_text:
-            print(f"[warn] No frontmatter found in {filepath}; skipping")
-            continue
-
-        data = safe_load_yaml(fm_text)
-        if not isinstance(data, dict):
-            print(f"[warn] Frontmatter in {filepath} didn't parse to dict; skipping")
-            continue
-
-        rel_mmd = os.path.relpath(filepath, ROOT).replace('\\', '/')
-        rel_svg = rel_mmd[:-4] + '.svg'
-        rel_png = rel_mmd[:-4] + '.png'
-        rel_svg_inv = rel_mmd[:-4] + '-inverted.svg'
-        rel_png_inv = rel_mmd[:-4] + '-inverted.png'
-
-        svg_exists = os.path.exists(os.path.join(ROOT, rel_svg))
-        png_exists = os.path.exists(os.path.join(ROOT, rel_png))
-        svg_inv_exists = os.path.exists(os.path.join(ROOT, rel_svg_inv))
-        png_inv_exists = os.path.exists(os.path.join(ROOT, rel_png_inv))
-
-        output_img = rel_svg if svg_exists else (rel_png if png_exists else None)
-        output_img_inverted = rel_svg_inv if svg_inv_exists else (rel_png_inv if png_inv_exists else None)
-        last_generated = data.get('last_generated') or date.today().isoformat()
-
-        entry = {
-            'id': data.get('id'),
-            'title': data.get('title'),
-            'kind': data.get('kind'),
-            'area': data.get('area'),
-            'version': data.get('version'),
-            'tags': data.get('tags'),
-            'owner': data.get('owner'),
-            'ai_generator': data.get('ai_generator'),
-            'prompt_file': data.get('prompt_file'),
-            'prompt_hash': data.get('prompt_hash'),
-            'last_generated': last_generated,
-            'related_code': data.get('related_code', []),
-            'mmd': rel_mmd,
-            'svg': rel_svg if svg_exists else None,
-            'png': rel_png if png_exists else None,
-            'svg_inverted': rel_svg_inv if svg_inv_exists else None,
-            'png_inverted': rel_png_inv if png_inv_exists else None,
-            'image': output_img,
-            'image_inverted': output_img_inverted,
-            'png_scale': png_scale,
-            'svg_size_bytes': file_size_bytes(os.path.join(ROOT, rel_svg)) if svg_exists else None,
-            'png_size_bytes': file_size_bytes(os.path.join(ROOT, rel_png)) if png_exists else None,
-            'svg_inverted_size_bytes': file_size_bytes(os.path.join(ROOT, rel_svg_inv)) if svg_inv_exists else None,
-            'png_inverted_size_bytes': file_size_bytes(os.path.join(ROOT, rel_png_inv)) if png_inv_exists else None,
-        }
-
-        entries.append(entry)
-
-    entries.sort(key=lambda d: (d.get('id') or '').lower())
+    strict = os.environ.get("STRICT_IDS", "0") not in ("", "0")
+    files, sizes = scan_diagrams(DIAGRAMS_DIR)
+    worker = partial(build_entry, sizes=sizes, png_scale=png_scale, strict=strict)
+    max_workers = min(32, (os.cpu_count() or 4) * 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        entries = [e for e in ex.map(worker, files) if e is not None]
+
+    entries.sort(key=lambda d: (d['id'] or '').lower())
 
     output = {'diagrams': entries}
+    # Render in memory, write once, then swap in so readers never see a partial index
+    tmp_index = None
     try:
-        with open(OUT_INDEX, 'w', encoding='utf-8') as out_f:
-            yaml.dump(output, out_f, sort_keys=False, allow_unicode=True)
+        text = yaml.dump(output, Dumper=_Dumper, sort_keys=False, allow_unicode=True,
+                         default_flow_style=False)
+        fd, tmp_index = tempfile.mkstemp(dir=ROOT, prefix='.index-', suffix='.yml.tmp')
+        with os.fdopen(fd, 'wb') as out_f:
+            out_f.write(text.encode('utf-8'))
+        # mkstemp creates the file 0600; keep the index's existing permissions
+        try:
+            mode = stat.S_IMODE(os.stat(OUT_INDEX).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(tmp_index, mode)
+        os.replace(tmp_index, OUT_INDEX)
         print(f"[info] Wrote index to {OUT_INDEX} ({len(entries)} entries)")
     except Exception as e:
         print(f"[error] Failed to write index.yml: {e}")
+    finally:
+        if tmp_index is not None and os.path.exists(tmp_index):
+            os.unlink(tmp_index)
 
 if __name__ == "__main__":
     main()